@@ -1,125 +1,504 @@
 import os
+import csv
+import re
 import sqlite3
-import pandas as pd
-from flask import Flask, request, jsonify, g
+import hashlib
+import threading
+from functools import lru_cache
+from itertools import islice
+import orjson
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+from flask_compress import Compress
 import logging
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timezone
+from schema import migrate
 
 # Load environment variables
 load_dotenv()
 
+class ORJSONProvider(JSONProvider):
+    """JSON provider that serializes with orjson instead of the stdlib json module"""
+    
+    # orjson would write datetimes as ISO 8601 itself; pass them through to
+    # Flask's default so they keep its HTTP date format
+    options = orjson.OPT_PASSTHROUGH_DATETIME
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=DefaultJSONProvider.default, option=self.options).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # orjson already produces UTF-8 bytes, hand them to the response as-is
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=DefaultJSONProvider.default, option=self.options)
+        return self._app.response_class(body, mimetype='application/json')
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 app.config['DATABASE'] = 'bookstore.db'
 
+# Compress JSON responses (the book lists are highly repetitive). Streamed
+# responses like /books/changed are compressed chunk by chunk, which
+# flask-compress only supports for br/deflate
+app.config['COMPRESS_MIN_SIZE'] = 1024
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_ALGORITHM_STREAMING'] = ['br', 'deflate']
+Compress(app)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Secondary indexes on books: (name, CREATE statement)
+BOOK_INDEXES = [
+    ('idx_isbn13', 'CREATE INDEX IF NOT EXISTS idx_isbn13 ON books(isbn13)'),
+    # Partial index: only modified books have last_updated set, so the index stays
+    # small and serves both the range filter and ORDER BY of /books/changed
+    ('idx_books_modified', 'CREATE INDEX IF NOT EXISTS idx_books_modified ON books(last_updated) '
+                           'WHERE last_updated IS NOT NULL'),
+]
+
+# All books columns, in table order
+BOOK_FIELDS = (
+    'id', 'isbn13', 'isbn10', 'title', 'subtitle', 'authors', 'categories',
+    'thumbnail', 'description', 'published_year', 'average_rating', 'num_pages',
+    'ratings_count', 'stock_quantity', 'price', 'last_updated',
+)
+
+# What sync clients need from /books/changed unless they ask for more with ?fields=
+DEFAULT_CHANGED_FIELDS = ('id', 'isbn13', 'stock_quantity', 'price', 'last_updated')
+
+# last_updated is stored as INTEGER unix epoch seconds (see schema.py) and
+# rendered in CURRENT_TIMESTAMP's 'YYYY-MM-DD HH:MM:SS' UTC format for clients
+LAST_UPDATED_TEXT_SQL = "datetime(last_updated, 'unixepoch')"
+
+# Epoch second N hours ago, bound as '-N'
+WINDOW_START_SQL = "CAST(strftime('%s', 'now', ? || ' hours') AS INTEGER)"
+
+# Default and maximum page size for cursor-based polling with ?since=
+DEFAULT_CHANGED_LIMIT = 500
+MAX_CHANGED_LIMIT = 5000
+
+def book_json_sql(fields):
+    """Build a json_object() expression for the given book columns plus changedAt"""
+    pairs = ', '.join(
+        f"'{field}', {LAST_UPDATED_TEXT_SQL if field == 'last_updated' else field}"
+        for field in fields
+    )
+    return f"json_object({pairs}, 'changedAt', {LAST_UPDATED_TEXT_SQL})"
+
+@lru_cache(maxsize=64)
+def changed_books_sql(fields):
+    """Build the query for books modified within the last N hours, bound as '-N'"""
+    # CSV loading doesn't set last_updated, only actual modifications do.
+    # json_object builds each book's JSON in SQLite, so rows reach Python as
+    # ready-made strings; lru_cache maps each field set to one SQL string and
+    # so one statement cache entry
+    return f'''
+        SELECT id, last_updated, {book_json_sql(fields)}
+        FROM books
+        WHERE last_updated IS NOT NULL
+        AND last_updated > {WINDOW_START_SQL}
+        ORDER BY last_updated DESC
+    '''
+
+@lru_cache(maxsize=64)
+def changed_books_since_sql(fields):
+    """Build the query for books modified after a (last_updated, id) cursor"""
+    # Bound as (since, since_id, limit). Walks idx_books_modified forward from
+    # the cursor, so each poll reads only the new changes; id breaks ties
+    # between books modified in the same second
+    return f'''
+        SELECT id, last_updated, {book_json_sql(fields)}
+        FROM books
+        WHERE last_updated IS NOT NULL
+        AND (last_updated, id) > (?, ?)
+        ORDER BY last_updated, id
+        LIMIT ?
+    '''
+
+def parse_fields(value):
+    """Parse a ?fields= value into a tuple of book columns, None if it names unknown ones"""
+    if not value:
+        return DEFAULT_CHANGED_FIELDS
+    if value == 'all':
+        return BOOK_FIELDS
+    requested = {field.strip() for field in value.split(',')} | {'id'}
+    if not requested <= set(BOOK_FIELDS):
+        return None
+    # Canonical order, so equivalent requests share one cached query
+    return tuple(field for field in BOOK_FIELDS if field in requested)
+
+def parse_since(value):
+    """Parse a ?since= ISO 8601 timestamp into epoch seconds, None if invalid"""
+    try:
+        since = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    # Timestamps without an offset are UTC, like last_updated
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return int(since.timestamp())
+
+def format_timestamp(epoch):
+    """Render an epoch-seconds last_updated the way clients have always seen it"""
+    if epoch is None:
+        return None
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+# Same window as changed_books_sql(), counted (used by /books/debug)
+CHANGED_BOOKS_COUNT_SQL = f'''
+    SELECT COUNT(*) FROM books
+    WHERE last_updated IS NOT NULL
+    AND last_updated > {WINDOW_START_SQL}
+'''
+
+# Oldest change inside the window and newest change overall. Both are single
+# seeks on idx_books_modified, cheap enough to run before every poll: no
+# oldest means nothing changed in the window, and the pair identifies the
+# window's contents for ETag purposes
+CHANGED_BOOKS_PROBE_SQL = f'''
+    SELECT
+        (SELECT MIN(last_updated) FROM books
+         WHERE last_updated IS NOT NULL
+         AND last_updated > {WINDOW_START_SQL}),
+        (SELECT MAX(last_updated) FROM books WHERE last_updated IS NOT NULL)
+'''
+
+# Newest change overall, the probe for cursor-based polls
+NEWEST_CHANGE_SQL = 'SELECT MAX(last_updated) FROM books WHERE last_updated IS NOT NULL'
+
 # Database helper functions
+def configure_db(db):
+    """Apply connection-level SQLite tuning"""
+    # WAL lets readers keep going while the cron job writes; NORMAL only
+    # fsyncs at checkpoints, which is safe in WAL mode
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    db.execute('PRAGMA temp_store=MEMORY')
+    db.execute('PRAGMA cache_size=-131072')  # 128MB page cache, kept warm across requests
+    db.execute('PRAGMA mmap_size=268435456')  # 256MB memory-mapped I/O
+
+# One connection per thread for the lifetime of the process, so the SQLite
+# page cache and statement cache survive between requests
+_local = threading.local()
+
 def get_db():
     """Get database connection"""
-    if 'db' not in g:
-        g.db = sqlite3.connect(app.config['DATABASE'])
-        g.db.row_factory = sqlite3.Row
-    return g.db
-
-def close_db(e=None):
-    """Close database connection"""
-    db = g.pop('db', None)
+    db = getattr(_local, 'db', None)
+    if db is None:
+        db = sqlite3.connect(app.config['DATABASE'], cached_statements=512, check_same_thread=False)
+        db.row_factory = sqlite3.Row
+        configure_db(db)
+        _local.db = db
+    return db
+
+def close_db():
+    """Close this thread's database connection"""
+    db = getattr(_local, 'db', None)
     if db is not None:
+        _local.db = None
         db.close()
 
 def init_db():
     """Initialize the database with book table"""
     with app.app_context():
-        db = get_db()
-        cursor = db.cursor()
-        
-        # Create books table (simplified - no sync tracking)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS books (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                isbn13 TEXT UNIQUE,
-                isbn10 TEXT,
-                title TEXT NOT NULL,
-                subtitle TEXT,
-                authors TEXT,
-                categories TEXT,
-                thumbnail TEXT,
-                description TEXT,
-                published_year INTEGER,
-                average_rating REAL,
-                num_pages INTEGER,
-                ratings_count INTEGER,
-                stock_quantity INTEGER DEFAULT 10,
-                price REAL DEFAULT 0.0,
-                last_updated TIMESTAMP DEFAULT NULL
+        try:
+            create_schema(get_db())
+        finally:
+            # The main thread doesn't serve requests, so don't keep its
+            # connection open for the life of the process (an extra open
+            # connection also stops load_csv_data from leaving WAL mode)
+            close_db()
+
+def create_schema(db):
+    """Create the tables, indexes and triggers, migrating older databases"""
+    cursor = db.cursor()
+    
+    # Create books table (simplified - no sync tracking)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS books (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            isbn13 TEXT UNIQUE,
+            isbn10 TEXT,
+            title TEXT NOT NULL,
+            subtitle TEXT,
+            authors TEXT,
+            categories TEXT,
+            thumbnail TEXT,
+            description TEXT,
+            published_year INTEGER,
+            average_rating REAL,
+            num_pages INTEGER,
+            ratings_count INTEGER,
+            stock_quantity INTEGER DEFAULT 10,
+            price REAL DEFAULT 0.0,
+            last_updated TIMESTAMP DEFAULT NULL
+        )
+    ''')
+    
+    # Bring databases written by older versions up to date
+    migrate(cursor, int(datetime.now(timezone.utc).timestamp()))
+    
+    # Create indexes for ISBN13 lookups and recently-changed queries
+    # (idx_last_updated is superseded by the partial idx_books_modified)
+    cursor.execute('DROP INDEX IF EXISTS idx_last_updated')
+    for _, create_sql in BOOK_INDEXES:
+        cursor.execute(create_sql)
+    
+    # Single-row book counter kept up to date by triggers, since COUNT(*)
+    # has to scan the whole table; seeded from the existing rows once
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS book_count (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            n INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO book_count (id, n) SELECT 1, COUNT(*) FROM books')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_count_insert AFTER INSERT ON books
+        BEGIN UPDATE book_count SET n = n + 1 WHERE id = 1; END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS books_count_delete AFTER DELETE ON books
+        BEGIN UPDATE book_count SET n = n - 1 WHERE id = 1; END
+    ''')
+    
+    db.commit()
+    logger.info("Database initialized successfully")
+
+def get_book_count(db):
+    """Get the number of books from the trigger-maintained counter"""
+    row = db.execute('SELECT n FROM book_count WHERE id = 1').fetchone()
+    return row[0] if row else 0
+
+def load_csv_extension(db):
+    """Try to load SQLite's csv virtual table extension, return True on success"""
+    try:
+        db.enable_load_extension(True)
+        db.load_extension(os.getenv('SQLITE_CSV_EXTENSION', 'csv'))
+        return True
+    except (AttributeError, sqlite3.OperationalError) as e:
+        # Python builds without extension support have no enable_load_extension
+        logger.info(f"SQLite csv extension unavailable, loading CSV in Python: {e}")
+        return False
+    finally:
+        if hasattr(db, 'enable_load_extension'):
+            db.enable_load_extension(False)
+
+def published_year_range():
+    """Range of published years accepted from the CSV, anything else is stored as NULL"""
+    return 1450, datetime.now().year + 1
+
+# What both CSV load paths accept as a number (after trimming spaces); anything
+# else in a numeric column is treated as missing rather than failing the load
+NUMBER_RE = re.compile(r' *-?[0-9]+(\.[0-9]*)? *')
+
+def sql_number(column):
+    """SQL for a csv_in column's trimmed text if it matches NUMBER_RE, else NULL"""
+    value = f"trim({column})"
+    digits = f"CASE WHEN {value} GLOB '-*' THEN substr({value}, 2) ELSE {value} END"
+    return (f"CASE WHEN ({digits}) GLOB '[0-9]*' AND ({digits}) NOT GLOB '*[^0-9.]*' "
+            f"AND ({digits}) NOT GLOB '*.*.*' THEN {value} END")
+
+def insert_csv_virtual_table(cursor, csv_path):
+    """Insert books straight from the CSV file with SQLite's csv virtual table"""
+    filename = csv_path.replace("'", "''")
+    cursor.execute(f"CREATE VIRTUAL TABLE temp.csv_in USING csv(filename='{filename}', header=YES)")
+    try:
+        header = {row[1] for row in cursor.execute('PRAGMA temp.table_info(csv_in)')}
+        check_csv_columns(header)
+        # A column the CSV lacks reads as NULL (an empty field) in every row
+        columns = {name: name if name in header else 'NULL' for name, _ in CSV_COLUMNS}
+        
+        # Every csv_in column is TEXT; empty fields become NULL and all type
+        # coercion, validation and the price formula happen in SQL, so no row
+        # goes through Python. Rows without an ISBN13 or title are skipped.
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO books
+            (isbn13, isbn10, title, subtitle, authors, categories,
+             thumbnail, description, published_year, average_rating,
+             num_pages, ratings_count, stock_quantity, price)
+            SELECT trim(isbn13), NULLIF(trim({columns['isbn10']}), ''), trim(title),
+                   NULLIF(trim({columns['subtitle']}), ''), NULLIF(trim({columns['authors']}), ''),
+                   NULLIF(trim({columns['categories']}), ''), NULLIF(trim({columns['thumbnail']}), ''),
+                   NULLIF(trim({columns['description']}), ''),
+                   CASE WHEN year BETWEEN ? AND ? THEN year END,
+                   rating,
+                   CAST({sql_number(columns['num_pages'])} AS INTEGER),
+                   CAST({sql_number(columns['ratings_count'])} AS INTEGER),
+                   10,
+                   round(rating * 5 + 5, 2)
+            FROM (
+                SELECT *, COALESCE(NULLIF(CAST({sql_number(columns['average_rating'])} AS REAL), 0), 3.0) AS rating,
+                       CAST({sql_number(columns['published_year'])} AS INTEGER) AS year
+                FROM temp.csv_in
             )
-        ''')
-        
-        # Create index on ISBN13 for faster lookups
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_isbn13 ON books(isbn13)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_last_updated ON books(last_updated)')
-        
-        db.commit()
-        logger.info("Database initialized successfully")
+            WHERE trim(isbn13) <> '' AND trim(title) <> ''
+        ''', published_year_range())
+        return cursor.rowcount
+    finally:
+        cursor.execute('DROP TABLE temp.csv_in')
+
+# CSV columns in books INSERT order, with the kind of coercion each one needs
+CSV_COLUMNS = [
+    ('isbn13', 'text'), ('isbn10', 'text'), ('title', 'text'), ('subtitle', 'text'),
+    ('authors', 'text'), ('categories', 'text'), ('thumbnail', 'text'), ('description', 'text'),
+    ('published_year', 'year'), ('average_rating', 'rating'), ('num_pages', 'int'),
+    ('ratings_count', 'int'),
+]
+
+# Columns a CSV must have, since rows without them are skipped; any other
+# column it lacks is stored as NULL
+REQUIRED_CSV_COLUMNS = ('isbn13', 'title')
+
+def check_csv_columns(names):
+    """Raise ValueError if a CSV header lacks any of REQUIRED_CSV_COLUMNS"""
+    missing = [name for name in REQUIRED_CSV_COLUMNS if name not in names]
+    if missing:
+        raise ValueError(f"CSV is missing required columns: {', '.join(missing)}")
+
+# Expression templates per coercion kind; empty fields (and numbers that don't
+# match NUMBER_RE) become None
+CSV_COERCIONS = {
+    'text': '({v}.strip() or None)',
+    'int': '(int(float({v})) if is_number({v}) else None)',
+    'year': '(year if {min_year} <= year <= {max_year} else None)',
+    'rating': 'rating',
+}
+
+def build_row_ctor(header):
+    """Compile a function turning a raw CSV row into a books table row tuple"""
+    # Resolve column positions once and generate straight-line code for them,
+    # so building a row costs no dict lookups or per-field function calls
+    index = {name.strip(): i for i, name in enumerate(header)}
+    check_csv_columns(index)
+    # A column the CSV lacks reads as an empty field in every row
+    value = {name: f'r[{index[name]}]' if name in index else "''" for name, _ in CSV_COLUMNS}
+    min_year, max_year = published_year_range()
+    fields = [
+        CSV_COERCIONS[kind].format(v=value[name], min_year=min_year, max_year=max_year)
+        for name, kind in CSV_COLUMNS
+    ]
+    rating = value['average_rating']
+    year = value['published_year']
+    source = (
+        'def row_ctor(r):\n'
+        # Calculate price based on rating (simple formula): between $10-25
+        f'    rating = (float({rating}) if is_number({rating}) else 0.0) or 3.0\n'
+        f'    year = int(float({year})) if is_number({year}) else 0\n'
+        f'    return ({", ".join(fields)}, round(rating * 5 + 5, 2))\n'
+    )
+    namespace = {'is_number': NUMBER_RE.fullmatch}
+    exec(compile(source, '<row_ctor>', 'exec'), namespace)
+    return namespace['row_ctor']
+
+def read_csv_rows(csv_path):
+    """Stream books table row tuples from the CSV file"""
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        row_ctor = build_row_ctor(next(reader))
+        
+        # Skip rows without an ISBN13 or title instead of failing on them
+        yield from (row for row in map(row_ctor, reader) if row[0] and row[2])
+
+def set_journal_mode(db, mode):
+    """Try to switch the journal mode, return True if SQLite accepted it"""
+    # Leaving WAL needs the only open connection to the database, so this
+    # fails while other threads hold theirs; treat that as non-fatal
+    try:
+        return db.execute(f'PRAGMA journal_mode={mode}').fetchone()[0].upper() == mode
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Could not switch journal mode to {mode}: {e}")
+        return False
 
 def load_csv_data():
     """Load book data from CSV file into database"""
     try:
-        # Read CSV file
-        df = pd.read_csv('data/data.csv')
-        
-        # Clean column names (remove any extra spaces)
-        df.columns = df.columns.str.strip()
-        
+        csv_path = 'data/data.csv'
+
         db = get_db()
         cursor = db.cursor()
-        
-        # Insert books from CSV
-        books_inserted = 0
-        for _, row in df.iterrows():
+
+        # Prefer letting SQLite parse the CSV itself; fall back to the csv module
+        use_virtual_table = load_csv_extension(db)
+
+        # On the initial load, build the secondary indexes once at the end
+        # instead of maintaining them row by row, and skip fsyncs and keep the
+        # rollback journal in memory (when no other connection is open). A
+        # crash mid-load can then corrupt the database file, which is only
+        # acceptable because it holds no books yet: delete it and load again.
+        # Reloads keep the durable settings, since by then the file holds
+        # cron-modified prices and stock.
+        initial_load = cursor.execute('SELECT 1 FROM books LIMIT 1').fetchone() is None
+        memory_journal = False
+        try:
+            if initial_load:
+                db.execute('PRAGMA synchronous=OFF')
+                memory_journal = set_journal_mode(db, 'MEMORY')
+            
+            # Insert all books in a single transaction
+            # DON'T set last_updated when loading from CSV - only when actually modifying
+            db.execute('BEGIN')
             try:
-                # Calculate price based on rating (simple formula)
-                rating = float(row.get('average_rating', 3.0)) if pd.notna(row.get('average_rating')) else 3.0
-                price = round(rating * 5 + 5, 2)  # Price between $10-25 based on rating
-                
-                # DON'T set last_updated when loading from CSV - only when actually modifying
-                cursor.execute('''
-                    INSERT OR REPLACE INTO books 
-                    (isbn13, isbn10, title, subtitle, authors, categories, 
-                     thumbnail, description, published_year, average_rating, 
-                     num_pages, ratings_count, stock_quantity, price)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    str(row.get('isbn13', '')).strip(),
-                    str(row.get('isbn10', '')).strip(),
-                    str(row.get('title', '')).strip(),
-                    str(row.get('subtitle', '')).strip() if pd.notna(row.get('subtitle')) else None,
-                    str(row.get('authors', '')).strip(),
-                    str(row.get('categories', '')).strip(),
-                    str(row.get('thumbnail', '')).strip() if pd.notna(row.get('thumbnail')) else None,
-                    str(row.get('description', '')).strip() if pd.notna(row.get('description')) else None,
-                    int(row.get('published_year', 0)) if pd.notna(row.get('published_year')) else None,
-                    rating,
-                    int(row.get('num_pages', 0)) if pd.notna(row.get('num_pages')) else None,
-                    int(row.get('ratings_count', 0)) if pd.notna(row.get('ratings_count')) else None,
-                    10,  # Default stock quantity
-                    price
-                ))
-                books_inserted += 1
-            except Exception as e:
-                logger.warning(f"Failed to insert book: {e}")
-                continue
-        
-        db.commit()
+                # The UNIQUE constraint on isbn13 stays, since INSERT OR
+                # IGNORE relies on it
+                if initial_load:
+                    for name, _ in BOOK_INDEXES:
+                        cursor.execute(f'DROP INDEX IF EXISTS {name}')
+
+                if use_virtual_table:
+                    books_inserted = insert_csv_virtual_table(cursor, csv_path)
+                else:
+                    # executemany binds every row against one prepared statement
+                    # instead of re-parsing the SQL per row; rows are streamed from
+                    # the file, so the CSV is never held in memory. Books already
+                    # in the database (by ISBN13) are left untouched.
+                    cursor.executemany('''
+                        INSERT OR IGNORE INTO books
+                        (isbn13, isbn10, title, subtitle, authors, categories,
+                         thumbnail, description, published_year, average_rating,
+                         num_pages, ratings_count, stock_quantity, price)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 10, ?)
+                    ''', read_csv_rows(csv_path))  # 10 = default stock quantity
+                    books_inserted = cursor.rowcount
+
+                if initial_load:
+                    for _, create_sql in BOOK_INDEXES:
+                        cursor.execute(create_sql)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+        finally:
+            if memory_journal:
+                set_journal_mode(db, 'WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+
         logger.info(f"Successfully loaded {books_inserted} books from CSV")
         return books_inserted
         
     except Exception as e:
         logger.error(f"Error loading CSV data: {e}")
-        return 0
+        raise
+
+def count_csv_rows(csv_path):
+    """Count data rows in a CSV file by counting lines, without parsing it"""
+    # Scans 1MB chunks in C instead of building a Python object per row. Assumes
+    # no quoted field spans lines, which holds for data/data.csv.
+    lines = 0
+    last = b'\n'
+    with open(csv_path, 'rb') as f:
+        for buf in iter(lambda: f.read(1 << 20), b''):
+            lines += buf.count(b'\n')
+            last = buf[-1:]
+    if last != b'\n':
+        lines += 1  # Last line has no trailing newline
+    return max(lines - 1, 0)  # Minus the header
 
 # API Routes
 
@@ -131,6 +510,7 @@ def hello_world():
         "code": 200,
         "endpoints": [
             "/books/changed - GET recently changed books (last 24 hours)",
+            "/books/<id> - GET full details of one book",
             "/books/load-csv - POST load books from CSV - only on initial load",
             "/books/debug - GET debug timestamp and book modification info",
             "/books/debug-csv - GET debug CSV file access and loading issues",
@@ -143,45 +523,155 @@ def get_changed_books():
     """Get books that have been actually modified (not just loaded from CSV)"""
     try:
         db = get_db()
-        cursor = db.cursor()
         
-        # Get hours parameter (default 24 hours)
-        hours = int(request.args.get('hours', 24))
-        
-        # Get books that have been MODIFIED (have a last_updated timestamp)
-        # CSV loading doesn't set last_updated, only actual modifications do
-        cursor.execute('''
-            SELECT id, isbn13, isbn10, title, subtitle, authors, categories, 
-                   thumbnail, description, published_year, average_rating, 
-                   num_pages, ratings_count, stock_quantity, price, last_updated
-            FROM books 
-            WHERE last_updated IS NOT NULL 
-            AND last_updated > datetime('now', '-{} hours')
-            ORDER BY last_updated DESC
-        '''.format(hours))
-        
-        changed_books = []
-        for row in cursor.fetchall():
-            book_dict = dict(row)
-            book_dict['changedAt'] = book_dict['last_updated']  # Add changedAt field
-            changed_books.append(book_dict)
+        # Get fields parameter (default: the minimal sync projection)
+        fields = parse_fields(request.args.get('fields'))
+        if fields is None:
+            return jsonify({
+                "error": "Unknown field requested",
+                "available_fields": list(BOOK_FIELDS)
+            }), 400
+        
+        since = request.args.get('since')
+        if since is not None:
+            # Cursor mode: the next ?limit= changes after ?since= in
+            # last_updated order, and the hours window doesn't apply. Clients
+            # pass back next_since/next_since_id to get the following page
+            since = parse_since(since)
+            if since is None:
+                return jsonify({"error": "Invalid since timestamp, expected ISO 8601"}), 400
+            try:
+                since_id = int(request.args.get('since_id', 0))
+                limit = int(request.args.get('limit', DEFAULT_CHANGED_LIMIT))
+            except ValueError:
+                return jsonify({"error": "Invalid since_id or limit, expected integers"}), 400
+            limit = min(max(limit, 1), MAX_CHANGED_LIMIT)
+            hours = None
+        else:
+            # Get hours parameter (default 24 hours)
+            hours = int(request.args.get('hours', 24))
+            since_id = limit = None
         
         # Get total count for info
-        cursor.execute('SELECT COUNT(*) FROM books')
-        total_books = cursor.fetchone()[0]
+        total_books = get_book_count(db)
         
-        return jsonify({
-            "changed_books": changed_books,
-            "count": len(changed_books),
-            "total_books_in_db": total_books,
-            "hours_checked": hours,
-            "timestamp": datetime.now().isoformat(),
-            "message": f"Found {len(changed_books)} books actually modified in last {hours} hours"
-        })
+        # Cheap probe before running the main query
+        if since is None:
+            oldest, newest = db.execute(CHANGED_BOOKS_PROBE_SQL, (f"-{hours}",)).fetchone()
+            empty = oldest is None
+            window = f"{hours}|{oldest}"
+        else:
+            newest = db.execute(NEWEST_CHANGE_SQL).fetchone()[0]
+            empty = newest is None or newest < since
+            window = f"{since}|{since_id}|{limit}"
+        etag = hashlib.sha1(
+            f"{window}|{newest}|{total_books}|{','.join(fields)}".encode()
+        ).hexdigest()
+        last_modified = (
+            datetime.fromtimestamp(newest, timezone.utc) if newest else None
+        )
+        
+        def summary(count, next_since=since, next_since_id=since_id, has_more=False):
+            if since is None:
+                return {
+                    "count": count,
+                    "total_books_in_db": total_books,
+                    "hours_checked": hours,
+                    "timestamp": datetime.now().isoformat(),
+                    "message": f"Found {count} books actually modified in last {hours} hours"
+                }
+            return {
+                "count": count,
+                "total_books_in_db": total_books,
+                "since": format_timestamp(since),
+                "since_id": since_id,
+                "next_since": format_timestamp(next_since),
+                "next_since_id": next_since_id,
+                "has_more": has_more,
+                "timestamp": datetime.now().isoformat(),
+                "message": f"Found {count} books modified since {format_timestamp(since)}"
+            }
+        
+        # Let pollers revalidate without downloading (or us building) the body.
+        # Last-Modified is the newest change overall, so If-Modified-Since can
+        # only vouch for a cursor with nothing after it: an hours window also
+        # changes as books age out of it, and a later page has its own rows
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        elif since is None or not empty:
+            not_modified = False
+        else:
+            modified_since = request.if_modified_since
+            not_modified = (modified_since is not None and last_modified is not None
+                            and last_modified <= modified_since)
+        if not_modified:
+            response = Response(status=304)
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            return response
+        
+        # Nothing modified in the window: skip the main query entirely
+        if empty:
+            response = jsonify({"changed_books": [], **summary(0)})
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            return response
         
     except Exception as e:
         logger.error(f"Error getting changed books: {e}")
         return jsonify({"error": "Failed to retrieve changed books"}), 500
+    
+    def generate():
+        # Stream one JSON object per row straight off the cursor instead of
+        # building the whole list in memory before serializing it
+        cursor = db.cursor()
+        
+        # Get books that have been MODIFIED (have a last_updated timestamp)
+        if since is None:
+            cursor.execute(changed_books_sql(fields), (f"-{hours}",))
+        else:
+            # One extra row tells us whether another page follows
+            cursor.execute(changed_books_since_sql(fields), (since, since_id, limit + 1))
+        
+        yield '{"changed_books": ['
+        count = 0
+        next_since, next_since_id, has_more = since, since_id, False
+        for book_id, last_updated, book_json in cursor:
+            if count == limit:
+                has_more = True
+                break
+            yield (', ' if count else '') + book_json
+            next_since, next_since_id = last_updated, book_id
+            count += 1
+        
+        # The remaining fields depend on the rows, so they come last
+        yield '], ' + app.json.dumps(summary(count, next_since, next_since_id, has_more))[1:]
+    
+    response = Response(stream_with_context(generate()), mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    return response
+
+@app.route("/books/<int:book_id>", methods=["GET"])
+def get_book(book_id):
+    """Get all details of a single book"""
+    try:
+        db = get_db()
+        cursor = db.cursor()
+        
+        cursor.execute('SELECT * FROM books WHERE id = ?', (book_id,))
+        row = cursor.fetchone()
+        
+        if row is None:
+            return jsonify({"error": "Book not found"}), 404
+        
+        book = dict(row)
+        book['last_updated'] = format_timestamp(book['last_updated'])
+        return jsonify(book)
+        
+    except Exception as e:
+        logger.error(f"Error getting book {book_id}: {e}")
+        return jsonify({"error": "Failed to retrieve book"}), 500
 
 @app.route("/books/load-csv", methods=["POST"])
 def load_books_from_csv():
@@ -212,8 +702,8 @@ def debug_timestamps():
         
         # Get all books with last_updated (regardless of time)
         cursor.execute("""
-            SELECT id, title, last_updated, 
-                   (julianday('now') - julianday(last_updated)) * 24 as hours_ago
+            SELECT id, title, datetime(last_updated, 'unixepoch'), 
+                   (strftime('%s', 'now') - last_updated) / 3600.0 as hours_ago
             FROM books 
             WHERE last_updated IS NOT NULL 
             ORDER BY last_updated DESC 
@@ -235,11 +725,7 @@ def debug_timestamps():
         
         # Test the exact query used in /books/changed
         hours = int(request.args.get('hours', 24))
-        cursor.execute(f"""
-            SELECT COUNT(*) FROM books 
-            WHERE last_updated IS NOT NULL 
-            AND last_updated > datetime('now', '-{hours} hours')
-        """)
+        cursor.execute(CHANGED_BOOKS_COUNT_SQL, (f"-{hours}",))
         matching_count = cursor.fetchone()[0]
         
         return jsonify({
@@ -249,7 +735,7 @@ def debug_timestamps():
             "recent_modified_books": recent_books,
             "query_hours": hours,
             "books_matching_query": matching_count,
-            "query_used": f"last_updated > datetime('now', '-{hours} hours')"
+            "query_used": f"last_updated > CAST(strftime('%s', 'now', '-{hours} hours') AS INTEGER)"
         })
         
     except Exception as e:
@@ -260,9 +746,6 @@ def debug_timestamps():
 def debug_csv():
     """Debug CSV file access and loading issues"""
     try:
-        import os
-        import pandas as pd
-        
         # Get current working directory
         cwd = os.getcwd()
         
@@ -284,14 +767,15 @@ def debug_csv():
         
         if csv_exists:
             try:
-                # Read just first 3 rows for preview
-                df_preview = pd.read_csv(csv_path, nrows=3)
-                csv_columns = list(df_preview.columns)
-                csv_preview = df_preview.to_dict('records')
+                with open(csv_path, newline='', encoding='utf-8') as f:
+                    reader = csv.DictReader(f)
+                    
+                    # Read just first 3 rows for preview
+                    csv_preview = list(islice(reader, 3))
+                    csv_columns = list(reader.fieldnames or [])
                 
                 # Also get total row count
-                df_full = pd.read_csv(csv_path)
-                total_rows = len(df_full)
+                total_rows = count_csv_rows(csv_path)
             except Exception as e:
                 csv_error = str(e)
                 total_rows = 0
@@ -303,9 +787,7 @@ def debug_csv():
         book_count = 0
         try:
             db = get_db()
-            cursor = db.cursor()
-            cursor.execute("SELECT COUNT(*) FROM books")
-            book_count = cursor.fetchone()[0]
+            book_count = get_book_count(db)
         except Exception as e:
             db_error = str(e)
         
@@ -345,13 +827,6 @@ def test_modify_books():
             # Modify price slightly
             new_price = round(current_price * 1.1, 2)  # 10% increase
             
-            # Update with current timestamp
-            cursor.execute("""
-                UPDATE books 
-                SET price = ?, last_updated = CURRENT_TIMESTAMP 
-                WHERE id = ?
-            """, (new_price, book_id))
-            
             modified_books.append({
                 "id": book_id,
                 "title": title,
@@ -359,6 +834,13 @@ def test_modify_books():
                 "new_price": new_price
             })
         
+        # Update all of them with current timestamp through one prepared statement
+        cursor.executemany("""
+            UPDATE books 
+            SET price = ?, last_updated = CAST(strftime('%s', 'now') AS INTEGER) 
+            WHERE id = ?
+        """, [(book["new_price"], book["id"]) for book in modified_books])
+        
         db.commit()
         
         return jsonify({
@@ -373,8 +855,11 @@ def test_modify_books():
 
 # App teardown
 @app.teardown_appcontext
-def close_db_teardown(error):
-    close_db()
+def rollback_db_teardown(error):
+    """Don't let a failed request leave a transaction open on the shared connection"""
+    db = getattr(_local, 'db', None)
+    if db is not None and db.in_transaction:
+        db.rollback()
 
 # Initialize database on startup
 with app.app_context():
@@ -8,70 +8,256 @@ Typically modifies 10-200 books to simulate realistic e-commerce changes.
 import sqlite3
 import random
 import argparse
-from datetime import datetime
+import sys
+import time
+from itertools import chain
+
+from schema import migrate
+
+# Fixed statements; sqlite3's statement cache is keyed by SQL text, so these
+# compile once per connection and are reused across --daemon batches. The
+# id sampling and UPDATE queries are built with one ? per book and only hit
+# the cache when a batch happens to have the same size.
+BOOK_COLUMNS_SQL = "SELECT id, title, price FROM books"
+ID_RANGE_SQL = "SELECT MIN(id), MAX(id) FROM books"
+RANDOM_BOOKS_SQL = f"{BOOK_COLUMNS_SQL} ORDER BY RANDOM() LIMIT ?"
+BOOK_COUNT_SQL = "SELECT n FROM book_count WHERE id = 1"
+
+
+def get_book_count(cursor):
+    """Get the number of books without scanning the table"""
+    # Reads the one-row counter the API's triggers keep in step with books;
+    # databases created before that counter existed fall back to COUNT(*)
+    try:
+        row = cursor.execute(BOOK_COUNT_SQL).fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    if row is None:
+        row = cursor.execute("SELECT COUNT(*) FROM books").fetchone()
+    return row[0]
 
 
 def get_random_books(cursor, count=50):
     """Get random books from the database"""
-    cursor.execute("SELECT id, title, price, stock_quantity FROM books ORDER BY RANDOM() LIMIT ?", (count,))
+    # Sample ids in Python and fetch them by primary key rather than sorting
+    # the whole table by RANDOM(); ids are oversampled to cover gaps left by
+    # deleted books
+    lo, hi = cursor.execute(ID_RANGE_SQL).fetchone()
+    if lo is not None and count * 2 <= hi - lo + 1:
+        ids = random.sample(range(lo, hi + 1), k=count * 2)
+        cursor.execute(
+            f"{BOOK_COLUMNS_SQL} WHERE id IN ({','.join('?' * len(ids))})",
+            ids
+        )
+        books = cursor.fetchall()
+        if len(books) >= count:
+            # The IN lookup returns rows in id order, so sample rather than take the first N
+            return random.sample(books, count)
+    
+    # Very sparse or tiny tables: still short, so sort after all
+    cursor.execute(RANDOM_BOOKS_SQL, (count,))
     return cursor.fetchall()
 
 
-def modify_book_price(cursor, book_id, current_price):
-    """Randomly modify book price (realistic price changes)"""
-    # Small price adjustments: +/- 5-15%
-    change_percent = random.uniform(0.05, 0.15)
-    direction = random.choice([1, -1])
-    new_price = round(current_price * (1 + direction * change_percent), 2)
-    
-    # Ensure price stays reasonable ($5 minimum, $100 maximum)
-    new_price = max(5.0, min(100.0, new_price))
+def draw_random_changes(count):
+    """Pre-draw every random value a run needs, as a dict of per-book lists"""
+    # One batch per distribution, so the main loop just indexes into them
+    # instead of making up to ten random.* calls per book
+    rand = random.random
+    return {
+        # Coin flips deciding which changes each book gets
+        'price_coin': [rand() for _ in range(count)],
+        'stock_coin': [rand() for _ in range(count)],
+        'rating_coin': [rand() for _ in range(count)],
+        # Price: +/- 5-15%
+        'price_percent': [0.05 + 0.10 * rand() for _ in range(count)],
+        'price_direction': random.choices((1, -1), k=count),
+        # Stock: 70% sales (-1 to -10), 30% restocking (+5 to +20)
+        'stock_change': [
+            sale if rand() < 0.7 else restock
+            for sale, restock in zip(random.choices(range(-10, 0), k=count),
+                                     random.choices(range(5, 21), k=count))
+        ],
+        # Rating: +/- up to 0.3
+        'rating_change': [0.6 * rand() - 0.3 for _ in range(count)],
+    }
+
+
+def modify_prices(prices, change_percents, directions):
+    """Compute new prices for a column of books (realistic price changes)"""
+    # Not clamped here, apply_updates() keeps them within $5-$100
+    return [
+        round(price * (1 + direction * percent), 2)
+        for price, percent, direction in zip(prices, change_percents, directions)
+    ]
+
+
+def apply_updates(cursor, changes, now):
+    """Write (book_id, price, stock change, rating change) rows in one UPDATE"""
+    if not changes:
+        return {}
     
-    cursor.execute("""
+    # One VALUES list joined to books by primary key: a None change leaves
+    # that column alone and all clamping happens here. UPDATE ... FROM needs
+    # SQLite 3.33+ and RETURNING 3.35+
+    values = ', '.join(['(?, ?, ?, ?)'] * len(changes))
+    cursor.execute(f"""
+        WITH v(id, price, stock_change, rating_change) AS (VALUES {values})
         UPDATE books 
-        SET price = ?, last_updated = CURRENT_TIMESTAMP 
-        WHERE id = ?
-    """, (new_price, book_id))
+        SET price = COALESCE(MAX(5.0, MIN(100.0, v.price)), books.price),
+            stock_quantity = COALESCE(MAX(0, books.stock_quantity + v.stock_change), books.stock_quantity),
+            average_rating = COALESCE(round(MAX(1.0, MIN(5.0, books.average_rating + v.rating_change)), 2),
+                                      books.average_rating),
+            last_updated = ? 
+        FROM v 
+        WHERE books.id = v.id
+        -- RETURNING reports REAL columns before affinity applies (4.0 comes back as 4)
+        RETURNING books.id, CAST(books.price AS REAL), books.stock_quantity,
+                  CAST(books.average_rating AS REAL)
+    """, [*chain.from_iterable(changes), now])
+    return {book_id: values for book_id, *values in cursor}
+
+
+def connect(db):
+    """Open the database and apply the connection PRAGMAs"""
+    # Autocommit mode: we manage the transaction ourselves rather than
+    # relying on sqlite3's implicit BEGINs
+    conn = sqlite3.connect(db, isolation_level=None, cached_statements=512)
+    cursor = conn.cursor()
+    
+    # WAL lets the API keep serving reads while we write, NORMAL sync skips
+    # the full fsync on every commit, and mmap serves the sampling reads
+    # without a read() per page (not applicable to :memory:)
+    if db != ':memory:':
+        cursor.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-20000;
+            PRAGMA mmap_size=268435456;
+        """)
     
-    return new_price
+    return conn
 
 
-def modify_book_stock(cursor, book_id, current_stock):
-    """Randomly modify book stock quantity (sales/restocking simulation)"""
-    # Realistic stock changes: sales (-1 to -10) or restocking (+5 to +20)
-    if random.random() < 0.7:  # 70% chance of sales (stock decrease)
-        change = random.randint(-10, -1)
-    else:  # 30% chance of restocking (stock increase)
-        change = random.randint(5, 20)
+def run_batch(conn, count, quiet=False):
+    """Modify up to count random books in one transaction and print the report"""
+    cursor = conn.cursor()
     
-    new_stock = max(0, current_stock + change)  # Don't go below 0
+    # Check if books exist
+    book_count = get_book_count(cursor)
     
-    cursor.execute("""
-        UPDATE books 
-        SET stock_quantity = ?, last_updated = CURRENT_TIMESTAMP 
-        WHERE id = ?
-    """, (new_stock, book_id))
+    if book_count == 0:
+        if not quiet:
+            print("❌ No books found in database. Load books first with: curl -X POST http://localhost:5000/books/load-csv")
+        return
+    
+    actual_count = min(count, book_count)
+    
+    if not quiet:
+        print(f"📚 Found {book_count} books in database")
+        print(f"🎲 Randomly modifying {actual_count} books (simulating e-commerce changes)...")
+        print()
+    
+    # One write transaction for the whole run; IMMEDIATE takes the write
+    # lock upfront so we can't hit SQLITE_BUSY halfway through, and the
+    # with block commits it at the end or rolls it back if anything raises,
+    # leaving the error for the caller to report
+    cursor.execute("BEGIN IMMEDIATE")
+    with conn:
+        # One timestamp for the whole run, as epoch seconds
+        now = int(time.time())
+        
+        # Bring databases the API hasn't migrated yet up to date before
+        # writing next to their old data
+        seeded = migrate(cursor, now).get(2, 0)
+        if seeded and not quiet:
+            print(f"🌱 Gave {seeded} unrated books a starting rating")
+            print()
+        
+        # Get random books, transposed into one list per column
+        books = get_random_books(cursor, actual_count)
+        book_ids, titles, prices = zip(*books)
+        draws = draw_random_changes(len(books))
+        
+        # 80% chance to modify price (common in e-commerce), 60% stock
+        # (sales/restocking), 20% rating (new reviews)
+        price_mask = [coin < 0.8 for coin in draws['price_coin']]
+        stock_mask = [coin < 0.6 for coin in draws['stock_coin']]
+        rating_mask = [coin < 0.2 for coin in draws['rating_coin']]
+        
+        # Compute the new prices in a single pass; stock and rating changes
+        # are deltas applied in SQL
+        new_prices = modify_prices(prices, draws['price_percent'], draws['price_direction'])
+        
+        # One (book_id, price, stock change, rating change) row per modified
+        # book, with None for the columns it keeps
+        changes = [
+            (book_id, price if do_price else None, stock if do_stock else None,
+             rating if do_rating else None)
+            for book_id, price, stock, rating, do_price, do_stock, do_rating in zip(
+                book_ids, new_prices, draws['stock_change'], draws['rating_change'],
+                price_mask, stock_mask, rating_mask)
+            if do_price or do_stock or do_rating
+        ]
+        # Sampling left the books in random order; bind them in id order so
+        # the primary-key lookups walk the table's B-tree front to back
+        changes.sort(key=lambda change: change[0])
+        
+        price_changes = sum(price_mask)
+        stock_changes = sum(stock_mask)
+        rating_changes = sum(rating_mask)
+        modified_count = len(changes)
+        
+        # Write all collected changes in one statement
+        updated = apply_updates(cursor, changes, now)
+    
+    if not quiet:
+        # Build the per-book report and write it in one go rather than
+        # several print() calls per book
+        log = []
+        for i, title in enumerate(titles):
+            log.append(f"📖 {title}")
+            
+            modifications = []
+            if book_ids[i] in updated:
+                new_price, new_stock, new_rating = updated[book_ids[i]]
+                if price_mask[i]:
+                    modifications.append(f"Price: ${prices[i]:.2f} → ${new_price:.2f}")
+                if stock_mask[i]:
+                    modifications.append(f"Stock: {draws['stock_change'][i]:+d} → {new_stock}")
+                if rating_mask[i]:
+                    modifications.append(f"Rating: → {new_rating}⭐")
+            
+            if modifications:
+                log.append(f"   ✅ {', '.join(modifications)}")
+            else:
+                log.append("   ⏭️  No changes")
+            log.append("")
+        sys.stdout.write("\n".join(log) + "\n")
     
-    return new_stock
+    if quiet:
+        # Minimal output for cron jobs
+        print(f"Modified {modified_count} books: {price_changes} prices, {stock_changes} stock, {rating_changes} ratings")
+    else:
+        print("🎉 E-commerce simulation complete!")
+        print(f"📊 Summary:")
+        print(f"   • {modified_count} books modified")
+        print(f"   • {price_changes} price changes")
+        print(f"   • {stock_changes} stock changes") 
+        print(f"   • {rating_changes} rating changes")
+        print()
+        print("💡 Check changed books with:")
+        print("   curl http://localhost:5000/books/changed")
+        print("   curl 'http://localhost:5000/books/changed?hours=1'  # last hour only")
 
 
-def modify_book_rating(cursor, book_id):
-    """Slightly adjust book rating (new reviews)"""
-    # Small rating changes: +/- 0.1 to 0.3
-    current_rating = cursor.execute("SELECT average_rating FROM books WHERE id = ?", (book_id,)).fetchone()[0]
-    if current_rating:
-        change = random.uniform(-0.3, 0.3)
-        new_rating = round(max(1.0, min(5.0, current_rating + change)), 2)
+def print_error(e, quiet):
+    """Print an error in the --quiet or decorated format"""
+    if quiet:
+        print(f"Error: {e}")
     else:
-        new_rating = round(random.uniform(3.0, 4.5), 2)
-    
-    cursor.execute("""
-        UPDATE books 
-        SET average_rating = ?, last_updated = CURRENT_TIMESTAMP 
-        WHERE id = ?
-    """, (new_rating, book_id))
-    
-    return new_rating
+        print(f"❌ Error: {e}")
 
 
 def main():
@@ -79,106 +265,44 @@ def main():
     parser.add_argument('--count', type=int, default=50, help='Number of books to modify (10-200 typical)')
     parser.add_argument('--db', default='bookstore.db', help='Database file path')
     parser.add_argument('--quiet', action='store_true', help='Minimal output for cron jobs')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keep running and modify a batch every --interval seconds instead of exiting')
+    parser.add_argument('--interval', type=int, default=12 * 60 * 60,
+                        help='Seconds between batches in --daemon mode (default: 12 hours)')
     args = parser.parse_args()
     
     # Validate count range
     if args.count < 1 or args.count > 500:
         print("❌ Count should be between 1 and 500")
         return
+    if args.interval < 1:
+        print("❌ Interval should be at least 1 second")
+        return
     
     # Connect to database
-    conn = sqlite3.connect(args.db)
-    cursor = conn.cursor()
+    conn = connect(args.db)
     
     try:
-        # Check if books exist
-        cursor.execute("SELECT COUNT(*) FROM books")
-        book_count = cursor.fetchone()[0]
-        
-        if book_count == 0:
-            if not args.quiet:
-                print("❌ No books found in database. Load books first with: curl -X POST http://localhost:5000/books/load-csv")
+        if not args.daemon:
+            run_batch(conn, args.count, args.quiet)
             return
         
-        actual_count = min(args.count, book_count)
-        
-        if not args.quiet:
-            print(f"📚 Found {book_count} books in database")
-            print(f"🎲 Randomly modifying {actual_count} books (simulating e-commerce changes)...")
-            print()
-        
-        # Get random books
-        books = get_random_books(cursor, actual_count)
-        
-        modified_books = []
-        price_changes = 0
-        stock_changes = 0
-        rating_changes = 0
-        
-        for book_id, title, current_price, current_stock in books:
-            if not args.quiet:
-                print(f"📖 {title}")
-            
-            modifications = []
-            
-            # 80% chance to modify price (common in e-commerce)
-            if random.random() < 0.8:
-                new_price = modify_book_price(cursor, book_id, current_price)
-                modifications.append(f"Price: ${current_price:.2f} → ${new_price:.2f}")
-                price_changes += 1
-            
-            # 60% chance to modify stock (sales/restocking)
-            if random.random() < 0.6:
-                new_stock = modify_book_stock(cursor, book_id, current_stock)
-                modifications.append(f"Stock: {current_stock} → {new_stock}")
-                stock_changes += 1
-            
-            # 20% chance to modify rating (new reviews)
-            if random.random() < 0.2:
-                new_rating = modify_book_rating(cursor, book_id)
-                modifications.append(f"Rating: → {new_rating}⭐")
-                rating_changes += 1
-            
-            if modifications and not args.quiet:
-                print(f"   ✅ {', '.join(modifications)}")
-                modified_books.append({
-                    'id': book_id,
-                    'title': title,
-                    'changes': modifications
-                })
-            elif not args.quiet:
-                print("   ⏭️  No changes")
-            
-            if not args.quiet:
-                print()
-        
-        # Commit changes
-        conn.commit()
-        
-        if args.quiet:
-            # Minimal output for cron jobs
-            print(f"Modified {len(modified_books)} books: {price_changes} prices, {stock_changes} stock, {rating_changes} ratings")
-        else:
-            print("🎉 E-commerce simulation complete!")
-            print(f"📊 Summary:")
-            print(f"   • {len(modified_books)} books modified")
-            print(f"   • {price_changes} price changes")
-            print(f"   • {stock_changes} stock changes") 
-            print(f"   • {rating_changes} rating changes")
-            print()
-            print("💡 Check changed books with:")
-            print("   curl http://localhost:5000/books/changed")
-            print("   curl 'http://localhost:5000/books/changed?hours=1'  # last hour only")
-        
+        # One connection for every batch, so its page and statement caches
+        # stay warm between runs
+        while True:
+            try:
+                run_batch(conn, args.count, args.quiet)
+            except Exception as e:
+                print_error(e, args.quiet)
+            sys.stdout.flush()
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
-        if args.quiet:
-            print(f"Error: {e}")
-        else:
-            print(f"❌ Error: {e}")
-        conn.rollback()
+        print_error(e, args.quiet)
     finally:
         conn.close()
 
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
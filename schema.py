@@ -0,0 +1,40 @@
+"""
+Schema version and data migrations for the books table.
+Shared by the API, which migrates on startup, and modify_books.py, which
+migrates before writing, so both bring older databases up to date the same way.
+"""
+
+# PRAGMA user_version of a fully migrated database
+SCHEMA_VERSION = 2
+
+# The migration to each version, run in order from the database's current
+# user_version; each is bound with :now, the epoch second to stamp changes with
+MIGRATIONS = {
+    # Version 1: last_updated moves from CURRENT_TIMESTAMP text to INTEGER
+    # epoch seconds, which are smaller on disk and in idx_books_modified
+    # and compare as plain integers
+    1: """
+        UPDATE books SET last_updated = CAST(strftime('%s', last_updated) AS INTEGER)
+        WHERE typeof(last_updated) = 'text'
+    """,
+    # Version 2: unrated books (NULL or 0, from older CSV loads) get a
+    # starting rating of 3.00-4.50 once, so the per-book rating change never
+    # has to branch on them; CSV loads now store 3.0 for them instead
+    2: """
+        UPDATE books
+        SET average_rating = 3.0 + (abs(random()) % 151) / 100.0, last_updated = :now
+        WHERE average_rating IS NULL OR average_rating = 0
+    """,
+}
+
+
+def migrate(cursor, now):
+    """Run the migrations the database is missing, return {version: rows changed}"""
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    changed = {
+        target: cursor.execute(MIGRATIONS[target], {"now": now}).rowcount
+        for target in range(version + 1, SCHEMA_VERSION + 1)
+    }
+    if changed:
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return changed